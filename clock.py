@@ -1,25 +1,42 @@
 #!/usr/bin/env python3
 import http.server
-import socketserver
+from http.server import ThreadingHTTPServer
+from concurrent.futures import ThreadPoolExecutor
 import threading
+import functools
+import gzip
 import json
 import os
 import time
-from urllib.parse import urlparse, parse_qs
-from datetime import datetime
+from urllib.parse import urlparse, unquote_plus
+from datetime import datetime, timedelta
+from html import escape
 import webbrowser
 
 # ───── Audio (pygame) ─────
 import pygame
 
-# You can tweak these if your device needs different values
-# (common defaults work for most Windows laptops)
-try:
-    pygame.mixer.init()   # frequency=44100, size=-16, channels=2, buffer=512
-    AUDIO_OK = True
-except Exception as e:
-    print("⚠️  pygame.mixer.init() failed:", e)
-    AUDIO_OK = False
+# Mixer init is deferred to the first playback: an initialized SDL mixer
+# keeps a core busy on some Linux systems even when nothing ever plays.
+AUDIO_OK = None                 # None = not tried yet, True/False after first use
+_AUDIO_LOCK = threading.Lock()
+
+def ensure_audio():
+    """Initialize the mixer on first use. Returns True if audio is usable."""
+    global AUDIO_OK
+    with _AUDIO_LOCK:
+        if AUDIO_OK is None:
+            # You can tweak these if your device needs different values.
+            # buffer=2048 (~46 ms at 44.1 kHz) avoids underruns without
+            # waking the audio thread too often.
+            try:
+                pygame.mixer.pre_init(frequency=44100, size=-16, channels=2, buffer=2048)
+                pygame.mixer.init()
+                AUDIO_OK = True
+            except Exception as e:
+                print("⚠️  pygame.mixer.init() failed:", e)
+                AUDIO_OK = False
+        return AUDIO_OK
 
 # ───── Config ─────
 PORT = 8000
@@ -31,35 +48,115 @@ MUSIC_DIR = USER_MUSIC_DIR if os.path.isdir(USER_MUSIC_DIR) else os.path.join(SC
 
 ALARM_FILE = os.path.join(SCRIPT_DIR, "alarm_settings.json")
 
+# orjson is much faster than stdlib json; fall back to a compact stdlib dump
+try:
+    import orjson
+
+    def _dumps(obj):
+        return orjson.dumps(obj, option=orjson.OPT_INDENT_2)
+except ImportError:
+    def _dumps(obj):
+        return json.dumps(obj, separators=(",", ":")).encode("utf-8")
+
+# watchfiles (inotify/FSEvents) keeps the ringtone list fresh without any
+# per-request scanning; without it we fall back to the mtime-keyed cache.
+try:
+    import watchfiles
+except ImportError:
+    watchfiles = None
+
 # ───── State ─────
-RINGING = False
-STOPPED_THIS_MINUTE = None      # stores "HH:MM AM/PM" of stop time to avoid immediate re-start
-LOCK = threading.Lock()         # protects RINGING & STOPPED_THIS_MINUTE
+RINGING_EVENT = threading.Event()  # set while the alarm loop is (being) started
+STOPPED_THIS_MINUTE = None      # "YYYY-MM-DD HH:MM AM/PM" of stop time to avoid immediate re-start
+LOCK = threading.Lock()         # protects STOPPED_THIS_MINUTE & CURRENT_ALARM
+CURRENT_ALARM = {}              # in-memory alarm settings (loaded once at startup, updated by /save)
+ALARM_EVENT = threading.Event() # set by /save so the checker recomputes its next fire time
 
 # ───── Helpers ─────
+_RINGTONE_CACHE = {"mtime": None, "files": [], "paths": set()}
+_RINGTONE_LOCK = threading.Lock()
+_RINGTONE_WATCHING = False      # True once the watchfiles thread owns the cache
+
+def _store_ringtones(files, mtime):
+    """Update the cache (caller holds _RINGTONE_LOCK)."""
+    _RINGTONE_CACHE["files"] = files
+    _RINGTONE_CACHE["mtime"] = mtime
+    _RINGTONE_CACHE["paths"] = {os.path.normcase(os.path.abspath(p)) for p in files}
+
+def _scan_ringtones():
+    # DirEntry carries the stat from the directory read, so is_file() is free
+    with os.scandir(MUSIC_DIR) as it:
+        return sorted(
+            entry.path
+            for entry in it
+            if entry.is_file(follow_symlinks=False) and entry.name.lower().endswith((".mp3", ".wav"))
+        )
+
+def _refresh_ringtones():
+    """Rescan MUSIC_DIR into the cache (called by the watcher thread)."""
+    with _RINGTONE_LOCK:
+        try:
+            st = os.stat(MUSIC_DIR)
+            _store_ringtones(_scan_ringtones(), st.st_mtime_ns)
+        except OSError:
+            _store_ringtones([], None)
+
+def _ringtone_watcher():
+    """Keep the ringtone cache fresh from filesystem events instead of polling."""
+    global _RINGTONE_WATCHING
+    _RINGTONE_WATCHING = True
+    _refresh_ringtones()
+    try:
+        for _changes in watchfiles.watch(MUSIC_DIR):
+            _refresh_ringtones()
+    except Exception as e:
+        print("⚠️  Ringtone watcher stopped, falling back to mtime checks:", e)
+        _RINGTONE_WATCHING = False
+
 def list_ringtones():
-    """Return absolute paths to mp3/wav files in MUSIC_DIR."""
-    if not os.path.isdir(MUSIC_DIR):
+    """Return absolute paths to mp3/wav files in MUSIC_DIR (cached until the dir changes)."""
+    if _RINGTONE_WATCHING:
+        with _RINGTONE_LOCK:
+            return _RINGTONE_CACHE["files"]
+    try:
+        st = os.stat(MUSIC_DIR)
+    except OSError:
         return []
-    files = []
-    for name in os.listdir(MUSIC_DIR):
-        if name.lower().endswith((".mp3", ".wav")):
-            files.append(os.path.join(MUSIC_DIR, name))
-    files.sort()
-    return files
+    with _RINGTONE_LOCK:
+        if st.st_mtime_ns == _RINGTONE_CACHE["mtime"]:
+            return _RINGTONE_CACHE["files"]
+        files = _scan_ringtones()
+        _store_ringtones(files, st.st_mtime_ns)
+        return files
+
+_ALARM_CACHE = {"mtime": -1, "data": {}}
 
 def load_alarm():
-    if not os.path.exists(ALARM_FILE):
+    """Return the saved alarm settings, re-parsing the file only when it changes."""
+    try:
+        st = os.stat(ALARM_FILE)
+    except OSError:
         return {}
+    if st.st_mtime_ns == _ALARM_CACHE["mtime"]:
+        return _ALARM_CACHE["data"]
     try:
         with open(ALARM_FILE, "r", encoding="utf-8") as f:
-            return json.load(f)
+            data = json.load(f)
     except Exception:
         return {}
+    _ALARM_CACHE["mtime"] = st.st_mtime_ns
+    _ALARM_CACHE["data"] = data
+    return data
 
 def save_alarm_obj(obj):
-    with open(ALARM_FILE, "w", encoding="utf-8") as f:
-        json.dump(obj, f, indent=2)
+    # Write to a temp file and os.replace so a reader never sees a half-written file
+    tmp = ALARM_FILE + ".tmp"
+    with open(tmp, "wb") as f:
+        f.write(_dumps(obj))
+    os.replace(tmp, ALARM_FILE)
+    # Keep the cache in step so the next load_alarm() skips the re-parse
+    _ALARM_CACHE["mtime"] = os.stat(ALARM_FILE).st_mtime_ns
+    _ALARM_CACHE["data"] = obj
 
 def normalize_time(hour_str, min_str, ampm_str):
     """Return ('HH','MM','AM/PM') normalized and a combined 'HH:MM AM/PM' string."""
@@ -77,47 +174,69 @@ def normalize_time(hour_str, min_str, ampm_str):
     ampm = "AM" if str(ampm_str).strip().upper() != "PM" else "PM"
     return f"{h:02d}", f"{m:02d}", ampm, f"{h:02d}:{m:02d} {ampm}"
 
-def current_h_m_ampm():
-    now = datetime.now()
-    hour12 = now.strftime("%I")  # 01..12
-    minute = now.strftime("%M")
-    ampm = now.strftime("%p")    # AM/PM
-    return hour12, minute, ampm
-
 def play_loop(path):
-    """Start looping playback via pygame.mixer.music."""
-    global RINGING
-    if not AUDIO_OK:
+    """Start looping playback via pygame.mixer.music.
+
+    The caller claims RINGING_EVENT before calling; we clear it on failure.
+    """
+    if not ensure_audio():
         print("❌ Audio device not initialized; cannot play.")
+        RINGING_EVENT.clear()
         return
     try:
         pygame.mixer.music.load(path)
         pygame.mixer.music.play(-1)  # loop indefinitely
-        with LOCK:
-            RINGING = True
         print(f"🔊 Ringing (looping): {path}")
     except Exception as e:
         print("⚠️  Failed to play:", e)
-        with LOCK:
-            RINGING = False
+        RINGING_EVENT.clear()
 
 def stop_playback():
-    """Stop playback and mark this minute as stopped."""
-    global RINGING, STOPPED_THIS_MINUTE
+    """Stop playback and mark this minute as stopped.
+
+    Always stops the mixer, not just when RINGING_EVENT is set: a /stop
+    landing in the checker's claim→play window clears the event while
+    playback still starts, and the stop must recover from that.
+    """
+    global STOPPED_THIS_MINUTE
+    if AUDIO_OK:
+        try:
+            pygame.mixer.music.stop()
+        except Exception:
+            pass
+    RINGING_EVENT.clear()
     with LOCK:
-        if RINGING and AUDIO_OK:
-            try:
-                pygame.mixer.music.stop()
-            except Exception:
-                pass
-        RINGING = False
-        STOPPED_THIS_MINUTE = datetime.now().strftime("%I:%M %p")
+        # Include the date so today's stop can never suppress tomorrow's fire
+        STOPPED_THIS_MINUTE = datetime.now().strftime("%Y-%m-%d %I:%M %p")
     print(f"⏹️  Alarm stopped for {STOPPED_THIS_MINUTE}")
 
 def resolve_tone_path(tone_path):
     """Return an existing absolute path for the ringtone or None."""
     if not tone_path:
         return None
+    # Fast path: the cached ringtone index answers with zero syscalls
+    with _RINGTONE_LOCK:
+        known = _RINGTONE_CACHE["paths"]
+        for candidate in (tone_path, os.path.join(MUSIC_DIR, tone_path)):
+            normed = os.path.normcase(os.path.abspath(candidate))
+            if normed in known:
+                return os.path.abspath(candidate)
+    try:
+        music_mtime = os.stat(MUSIC_DIR).st_mtime_ns
+    except OSError:
+        music_mtime = 0
+    try:
+        return _resolve_impl(tone_path, music_mtime)
+    except FileNotFoundError:
+        return None
+
+@functools.lru_cache(maxsize=128)
+def _resolve_impl(tone_path, music_mtime):
+    """Memoized lookup; music_mtime keys the cache so dir changes invalidate it.
+
+    Raises FileNotFoundError on a miss — lru_cache doesn't cache exceptions,
+    so a tone that appears later is found without waiting for a key change.
+    """
     candidates = []
     # If absolute and exists, use it.
     if os.path.isabs(tone_path):
@@ -132,54 +251,95 @@ def resolve_tone_path(tone_path):
     for p in candidates:
         if os.path.exists(p):
             return os.path.abspath(p)
-    return None
+    raise FileNotFoundError(tone_path)
 
 # ───── Alarm checker thread ─────
+def get_current_alarm():
+    """Return a snapshot of the in-memory alarm settings."""
+    with LOCK:
+        return dict(CURRENT_ALARM)
+
+def set_current_alarm(obj):
+    """Replace the in-memory alarm settings and wake the checker."""
+    with LOCK:
+        CURRENT_ALARM.clear()
+        CURRENT_ALARM.update(obj)
+    ALARM_EVENT.set()
+
+def next_fire_time(alarm):
+    """Return the next datetime at which the alarm should fire, or None if the
+    saved fields are invalid (e.g. a hand-edited settings file)."""
+    try:
+        h = int(alarm["hour"])
+        m = int(alarm["minute"])
+        ampm = str(alarm["ampm"]).strip().upper()
+    except (KeyError, TypeError, ValueError):
+        return None
+    if ampm not in ("AM", "PM") or not (1 <= h <= 12) or not (0 <= m <= 59):
+        return None
+    h %= 12
+    if ampm == "PM":
+        h += 12
+    now = datetime.now()
+    target = now.replace(hour=h, minute=m, second=0, microsecond=0)
+    if target <= now:
+        target += timedelta(days=1)
+    return target
+
 def alarm_checker():
-    """Check every second and start playback when time matches."""
-    global RINGING, STOPPED_THIS_MINUTE
+    """Sleep until the next computed fire time; recompute when /save changes the alarm."""
+    global STOPPED_THIS_MINUTE
 
-    last_minute_seen = None
-    last_log = 0
+    last_target_logged = None
 
     while True:
         try:
-            alarm = load_alarm()
+            alarm = get_current_alarm()
             # Expect: {'hour','minute','ampm','time12','ringtone'}
+            target = None
             if alarm.get("hour") and alarm.get("minute") and alarm.get("ampm") and alarm.get("ringtone"):
-                now_h, now_m, now_ap = current_h_m_ampm()
-                now_comp = f"{now_h}:{now_m} {now_ap}"
-                current_minute_key = f"{now_h}:{now_m}"  # used to reset stop flag each minute
-
-                # Reset the "stopped this minute" flag when minute ticks
-                if last_minute_seen != current_minute_key:
-                    with LOCK:
-                        STOPPED_THIS_MINUTE = None
-                    last_minute_seen = current_minute_key
-
-                # periodic log to console for visibility
-                if time.time() - last_log > 12:
-                    print(f"⏳ now={now_comp}   target={alarm.get('time12')}   ringing={RINGING}")
-                    last_log = time.time()
-
-                # Match by fields (no formatting surprises)
-                should_ring = (
-                    (alarm["hour"] == now_h) and
-                    (alarm["minute"] == now_m) and
-                    (alarm["ampm"].upper() == now_ap.upper())
-                )
-
-                with LOCK:
-                    blocked_this_minute = (STOPPED_THIS_MINUTE == now_comp)
-                    already_ringing = RINGING
-
-                if should_ring and not already_ringing and not blocked_this_minute:
-                    tone_hit = resolve_tone_path(alarm.get("ringtone"))
-                    if tone_hit:
-                        play_loop(tone_hit)
-                    else:
-                        print(f"❌ Ringtone path not found: {alarm.get('ringtone')}")
-            time.sleep(1)
+                target = next_fire_time(alarm)
+                if target is None:
+                    print(f"⚠️  Invalid alarm settings, ignoring: {alarm.get('time12')!r}")
+            if target is None:
+                # No (valid) alarm configured; park until /save sets one.
+                # Costs zero CPU — the thread just blocks on the event.
+                ALARM_EVENT.wait()
+                ALARM_EVENT.clear()
+                continue
+
+            wait_s = (target - datetime.now()).total_seconds()
+            if target != last_target_logged:
+                print(f"⏳ next fire: {alarm.get('time12')} (in {max(wait_s, 0):.0f}s)   ringing={RINGING_EVENT.is_set()}")
+                last_target_logged = target
+
+            # Wait at most 60s at a time: Event timeouts run on the monotonic
+            # clock, so suspend/resume or NTP/DST steps would otherwise delay
+            # the fire by the drift. A True return means /save changed the alarm.
+            if ALARM_EVENT.wait(timeout=min(max(wait_s, 0), 60)):
+                ALARM_EVENT.clear()
+                continue
+            # Decide on the wall clock, not the precomputed wait: if the timer
+            # overshot past the target, fire (milliseconds late) rather than
+            # letting next_fire_time() reschedule for tomorrow.
+            if datetime.now() < target:
+                continue  # re-derive the target against the wall clock
+
+            fire_key = target.strftime("%Y-%m-%d %I:%M %p")
+            with LOCK:
+                blocked_this_minute = (STOPPED_THIS_MINUTE == fire_key)
+                STOPPED_THIS_MINUTE = None  # consumed; next fire is a fresh minute
+
+            # get_busy() is the ground truth; the event claims playback before
+            # play_loop runs, so two near-simultaneous fires can't both play.
+            mixer_busy = bool(AUDIO_OK) and pygame.mixer.music.get_busy()
+            if not RINGING_EVENT.is_set() and not mixer_busy and not blocked_this_minute:
+                tone_hit = resolve_tone_path(alarm.get("ringtone"))
+                if tone_hit:
+                    RINGING_EVENT.set()
+                    play_loop(tone_hit)
+                else:
+                    print(f"❌ Ringtone path not found: {alarm.get('ringtone')}")
         except Exception as e:
             print("Checker error:", e)
             time.sleep(2)
@@ -189,53 +349,48 @@ def options_html(options, selected=None):
     html = []
     for value, label in options:
         sel = " selected" if selected and value == selected else ""
-        html.append(f"<option value=\"{value}\"{sel}>{label}</option>")
+        html.append(f"<option value=\"{escape(value, quote=True)}\"{sel}>{escape(label)}</option>")
     return "\n".join(html)
 
-def make_page():
-    ringtones = list_ringtones()
-    ring_opts = []
-    if ringtones:
-        for p in ringtones:
-            ring_opts.append((p, os.path.basename(p)))
-    else:
-        ring_opts.append(("", "No audio files found"))
-
-    saved = load_alarm()
-    saved_hour = saved.get("hour", "07")
-    saved_min = saved.get("minute", "00")
-    saved_ampm = saved.get("ampm", "AM")
-    saved_ring = saved.get("ringtone", ring_opts[0][0] if ring_opts else "")
+def mark_selected(options, value):
+    """Mark `value` as selected in a pre-rendered options string."""
+    if not value:
+        return options
+    return options.replace(f'value="{value}"', f'value="{value}" selected', 1)
 
-    hours = [(f"{h:02d}", f"{h:02d}") for h in range(1, 13)]
-    mins = [(f"{m:02d}", f"{m:02d}") for m in range(0, 60)]
-    ampm_opts = [("AM", "AM"), ("PM", "PM")]
+# The hour/minute/AM-PM option lists never change; render them once at import.
+HOURS_HTML = "".join(f'<option value="{h:02d}">{h:02d}</option>' for h in range(1, 13))
+MINUTES_HTML = "".join(f'<option value="{m:02d}">{m:02d}</option>' for m in range(0, 60))
+AMPM_HTML = '<option value="AM">AM</option><option value="PM">PM</option>'
 
-    return f"""<!doctype html>
+# Static page shell; only the {placeholders} are filled in per request.
+_PAGE_TEMPLATE = """<!doctype html>
 <html>
 <head>
   <meta charset="utf-8" />
   <title>Alarm Clock</title>
   <style>
-    body {{ font-family: Arial, sans-serif; max-width: 560px; margin: 2rem auto; }}
-    h1 {{ margin-bottom: .2rem }}
-    .card {{ padding: 1rem; border: 1px solid #ddd; border-radius: 12px; box-shadow: 0 2px 8px rgba(0,0,0,.06); }}
-    label {{ display:block; margin:.6rem 0 .2rem; font-weight:600 }}
-    select, button {{ padding:.4rem; font-size: 1rem; }}
-    .row {{ display:flex; gap:.5rem; align-items:center }}
-    .row > * {{ flex:1 }}
-    .muted {{ color:#666; font-size:.95rem }}
-    .warning {{ color:#b00 }}
-    .ok {{ color:#0a0 }}
+    body { font-family: Arial, sans-serif; max-width: 560px; margin: 2rem auto; }
+    h1 { margin-bottom: .2rem }
+    .card { padding: 1rem; border: 1px solid #ddd; border-radius: 12px; box-shadow: 0 2px 8px rgba(0,0,0,.06); }
+    label { display:block; margin:.6rem 0 .2rem; font-weight:600 }
+    select, button { padding:.4rem; font-size: 1rem; }
+    .row { display:flex; gap:.5rem; align-items:center }
+    .row > * { flex:1 }
+    .muted { color:#666; font-size:.95rem }
+    .warning { color:#b00 }
+    .ok { color:#0a0 }
   </style>
   <script>
-    function tick() {{
+    function tick() {
+      if (document.hidden) return;  // no work while the tab is backgrounded
       const now = new Date();
       const hh = String((now.getHours()%12)||12).padStart(2,'0');
       const mm = String(now.getMinutes()).padStart(2,'0');
       const ampm = now.getHours()>=12 ? 'PM' : 'AM';
       document.getElementById('now').textContent = hh+':'+mm+' '+ampm;
-    }}
+    }
+    document.addEventListener('visibilitychange', tick);
     setInterval(tick, 1000); window.onload = tick;
   </script>
 </head>
@@ -248,20 +403,20 @@ def make_page():
       <div class="row">
         <div>
           <label>Hour</label>
-          <select name="hour">{options_html(hours, saved_hour)}</select>
+          <select name="hour">{hour_options}</select>
         </div>
         <div>
           <label>Minute</label>
-          <select name="minute">{options_html(mins, saved_min)}</select>
+          <select name="minute">{minute_options}</select>
         </div>
         <div>
           <label>AM/PM</label>
-          <select name="ampm">{options_html(ampm_opts, saved_ampm)}</select>
+          <select name="ampm">{ampm_options}</select>
         </div>
       </div>
 
       <label>Ringtone</label>
-      <select name="ringtone">{options_html(ring_opts, saved_ring)}</select>
+      <select name="ringtone">{ringtone_options}</select>
 
       <div style="margin-top:1rem;">
         <button type="submit">Save Alarm</button>
@@ -269,10 +424,9 @@ def make_page():
       </div>
 
       <p class="muted" style="margin-top:.6rem;">
-        Music folder used: <code>{MUSIC_DIR}</code>
+        Music folder used: <code>{music_dir}</code>
       </p>
-      {"<p class='warning'>No audio files found. Put .mp3 or .wav files in the music folder.</p>" if not ringtones else ""}
-      {"<p class='warning'>Audio device not initialized; playback may fail.</p>" if not AUDIO_OK else "<p class='ok'>Audio device ready.</p>"}
+      {warnings}
     </form>
   </div>
 
@@ -285,8 +439,63 @@ def make_page():
 </body>
 </html>"""
 
+def make_page():
+    ringtones = list_ringtones()
+    ring_opts = []
+    if ringtones:
+        for p in ringtones:
+            ring_opts.append((p, os.path.basename(p)))
+    else:
+        ring_opts.append(("", "No audio files found"))
+
+    saved = load_alarm()
+    saved_hour = saved.get("hour", "07")
+    saved_min = saved.get("minute", "00")
+    saved_ampm = saved.get("ampm", "AM")
+    saved_ring = saved.get("ringtone", ring_opts[0][0] if ring_opts else "")
+
+    warnings = []
+    if not ringtones:
+        warnings.append("<p class='warning'>No audio files found. Put .mp3 or .wav files in the music folder.</p>")
+    if AUDIO_OK is False:
+        warnings.append("<p class='warning'>Audio device not initialized; playback may fail.</p>")
+    elif AUDIO_OK is None:
+        warnings.append("<p class='muted'>Audio device initializes on first play.</p>")
+    else:
+        warnings.append("<p class='ok'>Audio device ready.</p>")
+
+    return (_PAGE_TEMPLATE
+            .replace("{hour_options}", mark_selected(HOURS_HTML, saved_hour))
+            .replace("{minute_options}", mark_selected(MINUTES_HTML, saved_min))
+            .replace("{ampm_options}", mark_selected(AMPM_HTML, saved_ampm))
+            .replace("{ringtone_options}", options_html(ring_opts, saved_ring))
+            .replace("{music_dir}", escape(MUSIC_DIR))
+            .replace("{warnings}", "\n      ".join(warnings)))
+
 # ───── HTTP handler ─────
+# Fixed responses, encoded once instead of per request
+_STOPPED_PAGE = "<h2>⛔ Stopped</h2><p>Alarm sound stopped for this minute.</p><p><a href='/'>Back</a></p>".encode("utf-8")
+_NO_RINGTONE_PAGE = "<p>No ringtone selected. Save an alarm first.</p><p><a href='/'>Back</a></p>".encode("utf-8")
+_TEST_OK_PAGE = "<p>✅ Test OK (playing ~2s).</p><p><a href='/'>Back</a></p>".encode("utf-8")
+_NO_AUDIO_PAGE = "<p>❌ Audio device not initialized. Check speakers/output.</p><p><a href='/'>Back</a></p>".encode("utf-8")
+
+def parse_query(query):
+    """Flat key→value parse for the fixed /save form (cheaper than parse_qs)."""
+    out = {}
+    for kv in query.split("&"):
+        k, _, v = kv.partition("=")
+        if k:
+            out[k] = unquote_plus(v)
+    return out
+
 class Handler(http.server.SimpleHTTPRequestHandler):
+    # HTTP/1.1 so the browser reuses the connection between page loads
+    protocol_version = "HTTP/1.1"
+    # Drop idle keep-alive connections quickly so they don't pin pool workers
+    timeout = 5
+    # TCP_NODELAY: the responses are tiny, don't let Nagle delay them
+    disable_nagle_algorithm = True
+
     def do_GET(self):
         parsed = urlparse(self.path)
         path = parsed.path
@@ -294,11 +503,11 @@ class Handler(http.server.SimpleHTTPRequestHandler):
             self.respond_html(make_page())
 
         elif path == "/save":
-            params = parse_qs(parsed.query)
-            hour = params.get("hour", ["07"])[0]
-            minute = params.get("minute", ["00"])[0]
-            ampm = params.get("ampm", ["AM"])[0]
-            ringtone = params.get("ringtone", [""])[0]
+            params = parse_query(parsed.query)
+            hour = params.get("hour", "07")
+            minute = params.get("minute", "00")
+            ampm = params.get("ampm", "AM")
+            ringtone = params.get("ringtone", "")
 
             H, M, AP, time12 = normalize_time(hour, minute, ampm)
 
@@ -307,8 +516,8 @@ class Handler(http.server.SimpleHTTPRequestHandler):
             if not tone_hit:
                 self.respond_html(
                     f"<h2>⚠️ Ringtone not found</h2>"
-                    f"<p>We couldn't find: <code>{ringtone or '(empty)'}</code></p>"
-                    f"<p>Put .mp3 or .wav files in <code>{MUSIC_DIR}</code> and select again.</p>"
+                    f"<p>We couldn't find: <code>{escape(ringtone) or '(empty)'}</code></p>"
+                    f"<p>Put .mp3 or .wav files in <code>{escape(MUSIC_DIR)}</code> and select again.</p>"
                     f"<p><a href='/'>Back</a></p>"
                 )
                 return
@@ -319,53 +528,107 @@ class Handler(http.server.SimpleHTTPRequestHandler):
                 "ringtone": tone_hit  # store the resolved absolute path
             }
             save_alarm_obj(data)
+            set_current_alarm(data)
             self.respond_html(
                 f"<h2>✅ Saved!</h2>"
                 f"<p>Alarm: <b>{time12}</b></p>"
-                f"<p>Ringtone: <code>{os.path.basename(tone_hit)}</code></p>"
+                f"<p>Ringtone: <code>{escape(os.path.basename(tone_hit))}</code></p>"
                 f"<p><a href='/'>Back</a></p>"
             )
 
         elif path == "/stop":
             stop_playback()
-            self.respond_html("<h2>⛔ Stopped</h2><p>Alarm sound stopped for this minute.</p><p><a href='/'>Back</a></p>")
+            self.respond_html(_STOPPED_PAGE)
 
         elif path == "/test":
             alarm = load_alarm()
             tone = alarm.get("ringtone", "")
             if not tone:
-                self.respond_html("<p>No ringtone selected. Save an alarm first.</p><p><a href='/'>Back</a></p>")
+                self.respond_html(_NO_RINGTONE_PAGE)
                 return
             try:
-                if AUDIO_OK:
+                if ensure_audio():
                     pygame.mixer.music.load(tone)
                     pygame.mixer.music.play()
-                    time.sleep(1.8)
-                    pygame.mixer.music.stop()
-                    self.respond_html("<p>✅ Test OK (played ~2s).</p><p><a href='/'>Back</a></p>")
+                    # Schedule the stop instead of sleeping in the handler,
+                    # so the response (and the worker thread) isn't held up.
+                    threading.Timer(1.8, pygame.mixer.music.stop).start()
+                    self.respond_html(_TEST_OK_PAGE)
                 else:
-                    self.respond_html("<p>❌ Audio device not initialized. Check speakers/output.</p><p><a href='/'>Back</a></p>")
+                    self.respond_html(_NO_AUDIO_PAGE)
             except Exception as e:
-                self.respond_html(f"<p>❌ Test failed: {e}</p><p><a href='/'>Back</a></p>")
+                self.respond_html(f"<p>❌ Test failed: {escape(str(e))}</p><p><a href='/'>Back</a></p>")
+
+        elif path in ("/favicon.ico", "/robots.txt"):
+            # Browsers request these automatically; skip the filesystem walk
+            self.send_response(204)
+            self.end_headers()
 
         else:
             # Serve other static files if needed
             return super().do_GET()
 
     def respond_html(self, html):
+        body = html if isinstance(html, bytes) else html.encode("utf-8")
+        gzipped = "gzip" in self.headers.get("Accept-Encoding", "")
+        if gzipped:
+            body = gzip.compress(body, compresslevel=6)
         self.send_response(200)
         self.send_header("Content-Type", "text/html; charset=utf-8")
+        if gzipped:
+            self.send_header("Content-Encoding", "gzip")
+        self.send_header("Content-Length", str(len(body)))
+        self.send_header("Connection", "keep-alive")
         self.end_headers()
-        self.wfile.write(html.encode("utf-8"))
+        self.wfile.write(body)
+
+# ───── Server ─────
+class AlarmHTTPServer(ThreadingHTTPServer):
+    """Threaded server so a slow handler (e.g. /test) can't block /stop.
+
+    Requests are dispatched to a small fixed pool instead of one new
+    thread per connection, so refresh-spam can't pile up threads.
+    """
+    daemon_threads = True
+    allow_reuse_address = True   # restart without waiting out TIME_WAIT
+    request_queue_size = 128     # default backlog of 5 throttles bursty accepts
+
+    # A worker is held for a whole keep-alive connection, not one request,
+    # and browsers open up to 6 connections per origin — size well above that.
+    def __init__(self, *args, max_workers=16, **kwargs):
+        self._pool = ThreadPoolExecutor(max_workers=max_workers)
+        super().__init__(*args, **kwargs)
+
+    def process_request(self, request, client_address):
+        self._pool.submit(self._handle_request, request, client_address)
+
+    def _handle_request(self, request, client_address):
+        try:
+            self.finish_request(request, client_address)
+        except Exception:
+            self.handle_error(request, client_address)
+        finally:
+            self.shutdown_request(request)
+
+    def server_close(self):
+        super().server_close()
+        self._pool.shutdown(wait=False)
 
 # ───── Main ─────
 def main():
+    # Read the saved alarm once; from here on /save keeps the in-memory copy fresh
+    CURRENT_ALARM.update(load_alarm())
+
     # Start checker thread
     t = threading.Thread(target=alarm_checker, daemon=True)
     t.start()
 
+    # Keep the ringtone list fresh from fs events when watchfiles is installed
+    if watchfiles is not None and os.path.isdir(MUSIC_DIR):
+        threading.Thread(target=_ringtone_watcher, daemon=True).start()
+
     # Start server
-    with socketserver.TCPServer(("", PORT), Handler) as httpd:
+    with AlarmHTTPServer(("", PORT), Handler) as httpd:
         url = f"http://localhost:{PORT}"
         print(f"🌐 Serving {url}   (Music dir: {MUSIC_DIR})")
         try: